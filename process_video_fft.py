@@ -8,75 +8,741 @@ Generates an HTML visualization with synchronized playback.
 import argparse
 import cv2
 import numpy as np
+import scipy.fft
 from pathlib import Path
 import base64
+import os
+import queue
+import shutil
+import string
+import subprocess
+import threading
+from multiprocessing import shared_memory
+
+# Batches buffered between the decode, FFT and encode stages; small so a
+# stalled stage applies backpressure instead of piling up frames
+PIPELINE_DEPTH = 4
+
+# Route scipy.fft through pyFFTW when available: FFTW plans are built once
+# per (shape, dtype) and cached, so every batch after the first reuses the
+# same plan and scratch buffers instead of re-planning per call.
+try:
+    import pyfftw
+    import pyfftw.interfaces.scipy_fft
+
+    pyfftw.config.NUM_THREADS = os.cpu_count()
+    pyfftw.interfaces.cache.enable()
+    pyfftw.interfaces.cache.set_keepalive_time(60.0)
+    scipy.fft.set_global_backend(pyfftw.interfaces.scipy_fft)
+except ImportError:
+    pass
+
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+
+try:
+    import av
+    HAVE_PYAV = True
+except ImportError:
+    HAVE_PYAV = False
+
+try:
+    from tqdm import tqdm
+except ImportError:
+    tqdm = None
+
+# GPU path: cuFFT runs the whole batched 2D FFT in a few kernel launches,
+# which dominates CPU FFT for HD/4K frames. Requires both cupy and a
+# visible CUDA device (getDeviceCount raises without a driver).
+try:
+    import cupy as cp
+    HAVE_CUPY = cp.cuda.runtime.getDeviceCount() > 0
+except Exception:
+    HAVE_CUPY = False
+
+# OpenCV's own CUDA module as a second GPU option that needs no extra
+# dependency; pip wheels usually ship without CUDA, so this is often False
+try:
+    HAVE_CV2_CUDA = cv2.cuda.getCudaEnabledDeviceCount() > 0
+except Exception:
+    HAVE_CV2_CUDA = False
+
+if HAVE_NUMBA:
+    # One compiled kernel per frame shape; a video has a single (H, W),
+    # so in practice this holds one entry
+    _KERNEL_CACHE = {}
+
+    def _get_spec_kernel(height, width):
+        """
+        Compile (and cache) the fused post-FFT kernel specialized to one
+        frame shape. The dimensions are closure constants, so LLVM sees
+        fixed loop bounds and constant shift/mirror offsets and can
+        vectorize/unroll accordingly, instead of treating them as runtime
+        values read from the array descriptors on every call.
+        """
+        kernels = _KERNEL_CACHE.get((height, width))
+        if kernels is not None:
+            return kernels
+
+        half_w = width // 2 + 1
+        # Columns 1..mirror_w-1 of the half spectrum have a mirrored twin
+        mirror_w = width - width // 2
+        half_h = height // 2
+        shift_w = width // 2
+
+        @njit(parallel=True, fastmath=True)
+        def _spec_minmax(spec):
+            """
+            Min/max of the log magnitude of a half spectrum (the mirrored
+            columns repeat values from the half spectrum, so scanning the
+            half spectrum covers the full range).
+            """
+            row_min = np.empty(height, dtype=np.float32)
+            row_max = np.empty(height, dtype=np.float32)
+            for i in prange(height):
+                lo = np.inf
+                hi = -np.inf
+                for j in range(half_w):
+                    v = np.log1p(np.abs(spec[i, j]))
+                    lo = min(lo, v)
+                    hi = max(hi, v)
+                row_min[i] = lo
+                row_max[i] = hi
+            return row_min.min(), row_max.max()
+
+        @njit(parallel=True, fastmath=True)
+        def _spec_to_uint8(spec, mn, mx, out):
+            """
+            Fused post-FFT pass: turn a half spectrum (H, W//2+1 complex)
+            into the full uint8 magnitude image (H, W) normalized against
+            the given [mn, mx] range, DC centered. One streamed
+            normalize-and-mirror pass; no intermediate float arrays, and
+            the fftshift quadrant swap is folded into the destination
+            indices instead of a separate copy.
+            """
+            scale = np.float32(255.0 / (mx - mn + 1e-12))
+            # Normalize to uint8 (clamped: the range may come from other
+            # frames), writing each value to its own column and its
+            # Hermitian mirror at (-i % H, -j % W). fftshift moves
+            # frequency (i, j) to ((i + H//2) % H, (j + W//2) % W), so
+            # that offset is applied at write time rather than as an
+            # extra full-frame copy afterwards.
+            for i in prange(height):
+                si = (i + half_h) % height
+                smi = (half_h - i) % height
+                for j in range(half_w):
+                    v = (np.log1p(np.abs(spec[i, j])) - mn) * scale
+                    u = np.uint8(min(np.float32(255.0), max(np.float32(0.0), v)))
+                    out[si, (j + shift_w) % width] = u
+                    if 0 < j < mirror_w:
+                        out[smi, (shift_w - j) % width] = u
+
+        kernels = (_spec_minmax, _spec_to_uint8)
+        _KERNEL_CACHE[(height, width)] = kernels
+        return kernels
+
+# Number of frames transformed per FFT call; amortizes planning overhead
+# and lets pocketfft spread the batch across worker threads.
+DEFAULT_BATCH = 32
+
+
+class _SmoothedRange:
+    """
+    Exponentially smoothed min/max of the log magnitude across frames.
+    Normalizing every frame against its own min/max makes the output
+    brightness flicker; smoothed bounds track content slowly and give a
+    perceptually stable video. Bootstrapped from the first frame.
+    """
+
+    ALPHA = 0.05
 
+    def __init__(self):
+        self.mn = None
+        self.mx = None
 
-def process_frame_fft(frame):
+    def update(self, frame_min, frame_max):
+        """Fold one frame's min/max in and return the smoothed bounds."""
+        if self.mn is None:
+            self.mn = float(frame_min)
+            self.mx = float(frame_max)
+        else:
+            self.mn += self.ALPHA * (float(frame_min) - self.mn)
+            self.mx += self.ALPHA * (float(frame_max) - self.mx)
+        return self.mn, self.mx
+
+
+def _process_batch_gpu(stack, norm):
     """
-    Apply 2D FFT to a grayscale frame.
-    Returns the log magnitude spectrum with proper normalization.
+    GPU variant of process_batch_fft: batched rfft2 via cuFFT, then
+    magnitude, log, mirror, shift and normalization all on device, with
+    a single uint8 copy back to the host.
     """
-    # Apply 2D FFT
-    fft = np.fft.fft2(frame)
-    # Shift zero-frequency component to center
-    fft_shifted = np.fft.fftshift(fft)
-    # Calculate magnitude spectrum
-    magnitude = np.abs(fft_shifted)
-    # Apply log transform (add 1 to avoid log(0))
-    log_magnitude = np.log1p(magnitude)
-    # Normalize to 0-255 range for visualization
-    normalized = cv2.normalize(log_magnitude, None, 0, 255, cv2.NORM_MINMAX)
+    height, width = stack.shape[1:]
+    half_w = width // 2 + 1
+
+    stack_gpu = cp.asarray(stack, dtype=cp.float32)
+    half = cp.fft.rfft2(stack_gpu, axes=(1, 2))
+    mag = cp.abs(half)
+    cp.log1p(mag, out=mag)
+
+    # Mirror the half spectrum to the full width (same identity as the
+    # CPU path: |F[i, j]| == |F[(-i) % H, (-j) % W]|) and center DC
+    full = cp.empty((stack.shape[0], height, width), dtype=cp.float32)
+    full[:, :, :half_w] = mag
+    full[:, :, half_w:] = cp.roll(
+        full[:, ::-1, 1:width - width // 2], 1, axis=1
+    )[:, :, ::-1]
+    full = cp.fft.fftshift(full, axes=(1, 2))
+
+    # Per-frame reductions on device; only the scalars cross to the host
+    # to advance the smoothed normalization range in frame order
+    frame_min = cp.asnumpy(full.min(axis=(1, 2)))
+    frame_max = cp.asnumpy(full.max(axis=(1, 2)))
+    bounds = np.array(
+        [norm.update(lo, hi) for lo, hi in zip(frame_min, frame_max)],
+        dtype=np.float32,
+    )
+    mn = cp.asarray(bounds[:, 0]).reshape(-1, 1, 1)
+    mx = cp.asarray(bounds[:, 1]).reshape(-1, 1, 1)
+    scaled = (full - mn) * (255.0 / (mx - mn + 1e-12))
+    frames = cp.clip(scaled, 0, 255).astype(cp.uint8)
+
+    return cp.asnumpy(frames)
+
+
+# Reusable work buffers for the NumPy fallback, keyed by stack shape (at
+# most two entries: full batches and the shorter tail batch). Allocating
+# fresh H x W float arrays per batch churns the allocator for nothing.
+_SCRATCH = {}
+
+
+def _scratch_pair(shape):
+    """Return two reusable float32 buffers of the given shape."""
+    bufs = _SCRATCH.get(shape)
+    if bufs is None:
+        bufs = (
+            np.empty(shape, dtype=np.float32),
+            np.empty(shape, dtype=np.float32),
+        )
+        _SCRATCH[shape] = bufs
+    return bufs
+
 
-    return normalized.astype(np.uint8)
+# Per-frame spectrum size above which the column FFT pass is tiled;
+# roughly half a typical L2 slice so a column block stays cache-resident
+_COLUMN_TILE_BYTES = 1 << 21
 
 
-def process_video(input_path, output_path):
+def _rfft2_batched(stack):
     """
-    Process video: convert to grayscale and apply 2D FFT to each frame.
+    Batched 2D real FFT, computed separably: rows first, then columns.
+    Small frames go through the column pass in one call. For large frames
+    (4K grayscale is ~33 MB as float32) whole rows are evicted from cache
+    between the two passes, so the column transform is tiled: a narrow
+    block of columns is copied contiguous, transformed, and written back,
+    keeping its working set in L2 instead of re-reading DRAM per column.
+    """
+    rows = scipy.fft.rfft(stack, axis=2, workers=-1, overwrite_x=True)
+    height = rows.shape[1]
+
+    if rows[0].nbytes <= _COLUMN_TILE_BYTES:
+        return scipy.fft.fft(rows, axis=1, workers=-1, overwrite_x=True)
+
+    # Tile width sized so one (height, tile) complex64 block is about
+    # half of _COLUMN_TILE_BYTES, leaving room for the FFT's scratch.
+    # Tiling runs per frame: a batch-wide block would multiply the
+    # resident set by the batch size and blow the cache budget.
+    tile = max(8, _COLUMN_TILE_BYTES // (2 * height * 8))
+    for frame in rows:
+        for c0 in range(0, frame.shape[1], tile):
+            block = np.ascontiguousarray(frame[:, c0:c0 + tile])
+            frame[:, c0:c0 + tile] = scipy.fft.fft(
+                block, axis=0, workers=-1, overwrite_x=True
+            )
+    return rows
+
+
+def _process_batch_cv2_cuda(stack, norm):
+    """
+    GPU variant using OpenCV's CUDA module when cupy is unavailable.
+    cuda::dft on a real CV_32FC1 source always produces the packed R2C
+    half spectrum of width//2+1 columns (it does not honor
+    DFT_COMPLEX_OUTPUT), so magnitude -> log -> rescale run
+    device-resident on the half spectrum; each downloaded uint8 half is
+    then mirrored to full width and centered on the host, like the
+    NumPy fallback.
+    """
+    height, width = stack.shape[1:]
+    half_w = width // 2 + 1
+
+    # Constant 1.0 operand for the log1p add; cudaarithm does not treat
+    # a Python tuple as a Scalar, so a real GpuMat is used instead
+    ones = cv2.cuda_GpuMat()
+    ones.upload(np.ones((height, half_w), dtype=np.float32))
+
+    frames = np.empty(stack.shape, dtype=np.uint8)
+    full = np.empty((height, width), dtype=np.uint8)
+    for i in range(stack.shape[0]):
+        gpu_frame = cv2.cuda_GpuMat()
+        gpu_frame.upload(stack[i])
+        spectrum = cv2.cuda.dft(gpu_frame, gpu_frame.size())
+        # magnitude accepts the interleaved CV_32FC2 spectrum directly,
+        # so no split into real/imaginary planes is needed
+        magnitude = cv2.cuda.magnitude(spectrum)
+        # log1p to match the CPU path: add 1 before the log
+        log_magnitude = cv2.cuda.log(cv2.cuda.add(magnitude, ones))
+        # The mirrored columns only repeat half-spectrum values, so
+        # minMax over the half spectrum covers the full range
+        mn, mx = norm.update(*cv2.cuda.minMax(log_magnitude))
+        scale = 255.0 / (mx - mn + 1e-12)
+        # convertTo saturates to uint8, clamping values outside the
+        # smoothed range; alpha/beta by keyword, since the positional
+        # slot after rtype is dst in this binding
+        rescaled = log_magnitude.convertTo(
+            cv2.CV_8U, alpha=scale, beta=-mn * scale
+        )
+        # Mirror to full width, |F[i, j]| == |F[(-i) % H, (-j) % W]|,
+        # then shift DC to the center
+        full[:, :half_w] = rescaled.download()
+        full[:, half_w:] = np.roll(
+            full[::-1, 1:width - width // 2], 1, axis=0
+        )[:, ::-1]
+        frames[i] = np.fft.fftshift(full)
+    return frames
+
+
+def process_batch_fft(stack, norm=None, pad_pow2=False):
+    """
+    Apply 2D FFT to a batch of grayscale frames (batch axis first).
+    Returns the log magnitude spectra as uint8 frames, normalized against
+    an exponentially smoothed min/max range. Pass the same _SmoothedRange
+    instance across batches to keep brightness stable over a whole video.
+
+    With pad_pow2, frames are zero-padded to the next power of two before
+    the transform (radix-2 FFT kernels beat the mixed-radix path for
+    common video sizes like 1920x1080) and the centered spectrum is
+    cropped back to the original size afterwards.
+    """
+    if norm is None:
+        norm = _SmoothedRange()
+
+    if pad_pow2:
+        height, width = stack.shape[1:]
+        pad_h = 1 << (height - 1).bit_length()
+        pad_w = 1 << (width - 1).bit_length()
+        if (pad_h, pad_w) != (height, width):
+            padded = np.zeros((stack.shape[0], pad_h, pad_w), dtype=np.float32)
+            padded[:, :height, :width] = stack
+            full = process_batch_fft(padded, norm)
+            # DC sits at the center of the padded spectrum; crop the
+            # centered window back to the display size
+            y0 = (pad_h - height) // 2
+            x0 = (pad_w - width) // 2
+            return np.ascontiguousarray(
+                full[:, y0:y0 + height, x0:x0 + width]
+            )
+    # Keep the math in single precision end-to-end: float32 in, complex64
+    # spectra out. An 8-bit source gains nothing from float64, while FP32
+    # FFT kernels run twice the SIMD lanes and move half the bytes. No-op
+    # for the float32 stacks the reader thread already produces.
+    stack = np.asarray(stack, dtype=np.float32)
+
+    if HAVE_CUPY:
+        return _process_batch_gpu(stack, norm)
+    if HAVE_CV2_CUDA:
+        return _process_batch_cv2_cuda(stack, norm)
+
+    height, width = stack.shape[1:]
+
+    # Real-input 2D FFT: frames are real, so the spectrum is Hermitian
+    # symmetric and only width//2+1 columns need computing (~half the
+    # FLOPs and memory traffic of the complex transform). The batch axis
+    # leads so each frame is a contiguous block, matching pocketfft's
+    # preferred stride pattern and parallelizing cleanly across frames;
+    # overwrite_x lets the backend use the stack as scratch instead of
+    # allocating a working copy (the grayscale data is not needed again).
+    half = _rfft2_batched(stack)
+
+    frames = np.empty(stack.shape, dtype=np.uint8)
+
+    if HAVE_NUMBA:
+        # Fused kernels specialized to this frame shape: one min/max
+        # reduction to advance the smoothed range, one streamed pass for
+        # log magnitude, uint8 normalize and the centering shift
+        spec_minmax, spec_to_uint8 = _get_spec_kernel(height, width)
+        for i in range(stack.shape[0]):
+            mn, mx = norm.update(*spec_minmax(half[i]))
+            spec_to_uint8(half[i], np.float32(mn), np.float32(mx), frames[i])
+        return frames
+
+    # NumPy fallback: rebuild the full magnitude spectrum by mirroring,
+    # |F[i, j]| equals |F[(-i) % H, (-j) % W]|. All float work happens in
+    # two reused scratch buffers with out= ufuncs, so steady state does
+    # no per-batch heap allocation beyond the uint8 output.
+    half_w = width // 2 + 1
+    magnitude, shifted = _scratch_pair(stack.shape)
+    np.abs(half, out=magnitude[:, :, :half_w])
+    magnitude[:, :, half_w:] = np.roll(
+        magnitude[:, ::-1, 1:width - width // 2], 1, axis=1
+    )[:, :, ::-1]
+
+    # Shift zero-frequency component to center: fftshift expressed as
+    # quadrant copies through the second scratch buffer (np.fft.fftshift
+    # would allocate a fresh array per batch)
+    half_h = height // 2
+    shift_w = width // 2
+    shifted[:, half_h:, :] = magnitude[:, :height - half_h, :]
+    shifted[:, :half_h, :] = magnitude[:, height - half_h:, :]
+    magnitude[:, :, shift_w:] = shifted[:, :, :width - shift_w]
+    magnitude[:, :, :shift_w] = shifted[:, :, width - shift_w:]
+
+    # Apply log transform in place (add 1 to avoid log(0))
+    np.log1p(magnitude, out=magnitude)
+
+    # Normalize each frame to 0-255 range for visualization: one SIMD
+    # min/max reduction to advance the smoothed range, then an in-place
+    # rescale (clipped: the range may come from other frames)
+    for i in range(stack.shape[0]):
+        mn, mx = norm.update(magnitude[i].min(), magnitude[i].max())
+        scale = np.float32(255.0 / (mx - mn + 1e-12))
+        np.subtract(magnitude[i], np.float32(mn), out=magnitude[i])
+        np.multiply(magnitude[i], scale, out=magnitude[i])
+        np.clip(magnitude[i], 0, 255, out=magnitude[i])
+        frames[i] = magnitude[i]
+
+    return frames
+
+
+class _PyAVReader:
+    """
+    Decode frames directly to grayscale with PyAV. Video is stored as YUV,
+    so grayscale is just the decoder's Y plane; this skips both the
+    YUV->BGR conversion OpenCV does on decode and our BGR->GRAY pass.
     """
-    # Open input video
-    cap = cv2.VideoCapture(input_path)
-    if not cap.isOpened():
-        raise ValueError(f"Could not open video: {input_path}")
 
-    # Get video properties
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    def __init__(self, input_path):
+        self.container = av.open(input_path)
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = 'AUTO'
+        self.width = self.stream.codec_context.width
+        self.height = self.stream.codec_context.height
+        self.fps = float(self.stream.average_rate)
+        self.total_frames = self.stream.frames
+        self._frames = self.container.decode(self.stream)
+
+    def read_gray(self):
+        """Return the next frame as a uint8 grayscale array, or None at EOF."""
+        frame = next(self._frames, None)
+        if frame is None:
+            return None
+        return frame.to_ndarray(format='gray')
+
+    def release(self):
+        self.container.close()
+
+
+class _OpenCVReader:
+    """Fallback reader using cv2.VideoCapture when PyAV is not installed."""
+
+    def __init__(self, input_path):
+        self.cap = cv2.VideoCapture(input_path)
+        if not self.cap.isOpened():
+            raise ValueError(f"Could not open video: {input_path}")
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.total_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    def read_gray(self):
+        """Return the next frame as a uint8 grayscale array, or None at EOF."""
+        ret, frame = self.cap.read()
+        if not ret:
+            return None
+        # Convert to grayscale
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
 
-    print(f"Processing video: {input_path}")
-    print(f"Resolution: {width}x{height}, FPS: {fps}, Frames: {total_frames}")
+    def release(self):
+        self.cap.release()
 
-    # Create video writer with H.264 codec for browser compatibility
-    fourcc = cv2.VideoWriter_fourcc(*'avc1')
-    out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
 
-    frame_count = 0
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
+def _open_reader(input_path):
+    """Pick the PyAV grayscale-native reader when available, cv2 otherwise."""
+    if HAVE_PYAV:
+        try:
+            return _PyAVReader(input_path)
+        except av.FFmpegError as e:
+            raise ValueError(f"Could not open video: {input_path}") from e
+    return _OpenCVReader(input_path)
 
-        # Convert to grayscale
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
 
-        # Apply 2D FFT
-        fft_frame = process_frame_fft(gray)
+class _FFmpegWriter:
+    """
+    Encode by piping raw grayscale frames into a single ffmpeg process.
+    One subprocess handles the whole video, so libx264 stays hot and the
+    GRAY->BGR copy plus per-frame VideoWriter call overhead disappear;
+    ffmpeg does the gray->yuv420p conversion in one SIMD pass.
+
+    Frames travel through a shared-memory ring: write() drops a frame
+    into a free slot and returns, while a feeder thread hands the slot's
+    memoryview straight to ffmpeg's stdin. The encoder can run ahead of
+    the FFT without the per-frame tobytes() copy, and a full ring blocks
+    write() for natural backpressure.
+    """
+
+    RING_SLOTS = 16
+
+    def __init__(self, output_path, fps, width, height):
+        self.proc = subprocess.Popen(
+            [
+                'ffmpeg', '-y', '-loglevel', 'error',
+                '-f', 'rawvideo', '-pix_fmt', 'gray',
+                '-s', f'{width}x{height}', '-r', str(fps), '-i', '-',
+                '-c:v', 'libx264', '-preset', 'ultrafast',
+                '-pix_fmt', 'yuv420p',
+                output_path,
+            ],
+            stdin=subprocess.PIPE,
+        )
+
+        self.frame_bytes = width * height
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=self.RING_SLOTS * self.frame_bytes
+        )
+        self.slots = [
+            np.ndarray(
+                (height, width), dtype=np.uint8,
+                buffer=self.shm.buf, offset=k * self.frame_bytes,
+            )
+            for k in range(self.RING_SLOTS)
+        ]
+        self.free_q = queue.Queue()
+        for k in range(self.RING_SLOTS):
+            self.free_q.put(k)
+        self.full_q = queue.Queue()
+        self.error = None
+        self.feeder = threading.Thread(target=self._feed)
+        self.feeder.start()
+
+    def _feed(self):
+        try:
+            while True:
+                k = self.full_q.get()
+                if k is None:
+                    break
+                offset = k * self.frame_bytes
+                # Hand the slot's memoryview to the pipe directly; no
+                # intermediate bytes object is materialized
+                self.proc.stdin.write(
+                    self.shm.buf[offset:offset + self.frame_bytes]
+                )
+                self.free_q.put(k)
+        except OSError as e:
+            # ffmpeg died (bad path, full disk, rejected frame size...).
+            # Record the failure and post a sentinel so a producer blocked
+            # on the ring does not hang forever waiting for a free slot.
+            self.error = e
+            self.free_q.put(-1)
+
+    def _raise_pipe_error(self):
+        raise RuntimeError(
+            f"ffmpeg exited with code {self.proc.poll()}"
+        ) from self.error
+
+    def write(self, frame):
+        if self.error is not None:
+            self._raise_pipe_error()
+        k = self.free_q.get()
+        if k < 0:
+            # Sentinel from a dying feeder; leave it queued so later
+            # writes fail fast instead of blocking
+            self.free_q.put(k)
+            self._raise_pipe_error()
+        np.copyto(self.slots[k], frame)
+        self.full_q.put(k)
+
+    def release(self):
+        self.full_q.put(None)
+        self.feeder.join()
+        try:
+            try:
+                self.proc.stdin.close()
+            except OSError:
+                pass  # pipe already broken; the exit code tells the story
+            returncode = self.proc.wait()
+        finally:
+            # Drop the numpy views before closing, or the mapping is
+            # still exported and close() raises BufferError
+            self.slots = None
+            self.shm.close()
+            self.shm.unlink()
+        if returncode != 0:
+            self._raise_pipe_error()
+
+
+class _OpenCVWriter:
+    """Fallback writer using cv2.VideoWriter when ffmpeg is not on PATH."""
+
+    def __init__(self, output_path, fps, width, height):
+        # H.264 codec for browser compatibility
+        fourcc = cv2.VideoWriter_fourcc(*'avc1')
+        # isColor=False accepts the single-channel frames directly,
+        # skipping a GRAY->BGR triplication of every frame's bytes
+        self.is_color = False
+        self.out = cv2.VideoWriter(
+            output_path, fourcc, fps, (width, height), isColor=False
+        )
+        if not self.out.isOpened():
+            # Some encoder backends only take BGR input; reopen in color
+            # and pay the conversion on write
+            self.is_color = True
+            self.out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+
+    def write(self, frame):
+        if self.is_color:
+            # Convert back to BGR for video output
+            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+        self.out.write(frame)
+
+    def release(self):
+        self.out.release()
+
+
+def _open_writer(output_path, fps, width, height):
+    """Pick the ffmpeg pipe writer when available, cv2 otherwise."""
+    if shutil.which('ffmpeg'):
+        return _FFmpegWriter(output_path, fps, width, height)
+    return _OpenCVWriter(output_path, fps, width, height)
+
+
+def process_video(input_path, output_path, batch_size=DEFAULT_BATCH,
+                  pad_pow2=False):
+    """
+    Process video: convert to grayscale and apply 2D FFT to each frame.
+    """
+    if batch_size < 1:
+        raise ValueError(f"batch_size must be at least 1 (got {batch_size})")
+
+    # Open input video
+    cap = _open_reader(input_path)
 
-        # Convert back to BGR for video output
-        fft_bgr = cv2.cvtColor(fft_frame, cv2.COLOR_GRAY2BGR)
+    # Get video properties
+    fps = cap.fps
+    width = cap.width
+    height = cap.height
+    total_frames = cap.total_frames
 
-        # Write frame
-        out.write(fft_bgr)
+    print(f"Processing video: {input_path}")
+    print(f"Resolution: {width}x{height}, FPS: {fps}, Frames: {total_frames}")
 
-        frame_count += 1
-        if frame_count % 30 == 0:
-            print(f"Processed {frame_count}/{total_frames} frames...")
+    # Create video writer (H.264 output for browser compatibility)
+    out = _open_writer(output_path, fps, width, height)
+
+    # Three-stage pipeline: a reader thread decodes and grayscales frames,
+    # the main thread runs the batched FFT, and a writer thread feeds the
+    # encoder. Decode (libavcodec) and encode (libx264) then overlap the
+    # FFT instead of serializing with it. Batches flow through FIFO queues
+    # in order, so no reorder buffer is needed.
+    reader_q = queue.Queue(maxsize=PIPELINE_DEPTH)
+    writer_q = queue.Queue(maxsize=PIPELINE_DEPTH)
+
+    # Set when any stage fails, so the other stages wind down instead of
+    # blocking forever on a queue nobody drains
+    stop = threading.Event()
+    read_errors = []
+    write_errors = []
+
+    def read_batches():
+        try:
+            eof = False
+            while not eof and not stop.is_set():
+                # Fresh buffer per batch: the previous one may still be in
+                # flight in the FFT stage. float32 keeps FFT bandwidth half
+                # of numpy's float64 default.
+                stack = np.empty((batch_size, height, width), dtype=np.float32)
+                filled = 0
+                while filled < batch_size:
+                    gray = cap.read_gray()
+                    if gray is None:
+                        eof = True
+                        break
+                    stack[filled] = gray
+                    filled += 1
+                if filled > 0:
+                    reader_q.put(stack[:filled])
+        except Exception as e:
+            # Decode failures (e.g. PyAV on corrupt input) must not kill
+            # the thread before the sentinel, or the main loop blocks
+            # forever on reader_q
+            read_errors.append(e)
+            stop.set()
+        finally:
+            reader_q.put(None)
+
+    # tqdm batches its own updates and redraws in place with \r, instead
+    # of a flushed print line (and string allocation) every 30 frames
+    pbar = tqdm(total=total_frames, unit='frame') if tqdm else None
+
+    def write_batches():
+        frame_count = 0
+        while True:
+            fft_frames = writer_q.get()
+            if fft_frames is None:
+                break
+            if write_errors:
+                continue  # already failed; just drain the queue
+            try:
+                for fft_frame in fft_frames:
+                    out.write(fft_frame)
+            except Exception as e:
+                write_errors.append(e)
+                stop.set()
+                continue
+            frame_count += len(fft_frames)
+            if pbar is not None:
+                pbar.update(len(fft_frames))
+            elif frame_count % 30 < len(fft_frames):
+                print(f"Processed {frame_count}/{total_frames} frames...")
+
+    reader = threading.Thread(target=read_batches)
+    writer = threading.Thread(target=write_batches)
+    reader.start()
+    writer.start()
+
+    # One smoothed normalization range for the whole video, so brightness
+    # does not flicker with each frame's own min/max
+    norm = _SmoothedRange()
 
-    cap.release()
-    out.release()
+    try:
+        while not stop.is_set():
+            stack = reader_q.get()
+            if stack is None:
+                break
+            writer_q.put(process_batch_fft(stack, norm, pad_pow2=pad_pow2))
+    finally:
+        stop.set()
+        # The reader may be blocked putting into a full queue; draining
+        # frees it to see the stop flag and exit, so join cannot hang
+        # even when the loop above died mid-stream
+        while True:
+            try:
+                reader_q.get_nowait()
+            except queue.Empty:
+                break
+        writer_q.put(None)
+        reader.join()
+        writer.join()
+        if pbar is not None:
+            pbar.close()
+        cap.release()
+        out.release()
+
+    if read_errors:
+        raise read_errors[0]
+    if write_errors:
+        raise write_errors[0]
 
     print(f"Processing complete! Output saved to: {output_path}")
     return width, height, fps, total_frames
@@ -90,319 +756,18 @@ def generate_html(input_video, output_video, html_path):
     input_name = Path(input_video).name
     output_name = Path(output_video).name
 
-    html_content = """<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>2D FFT Video Comparison</title>
-    <style>
-        body {
-            margin: 0;
-            padding: 20px;
-            background-color: #1a1a1a;
-            color: #fff;
-            font-family: Arial, sans-serif;
-        }
-        .container {
-            max-width: 1800px;
-            margin: 0 auto;
-        }
-        h1 {
-            text-align: center;
-            margin-bottom: 30px;
-        }
-        .video-container {
-            display: flex;
-            gap: 20px;
-            justify-content: center;
-            margin-bottom: 30px;
-            flex-wrap: wrap;
-        }
-        .video-wrapper {
-            flex: 1;
-            min-width: 400px;
-            max-width: 800px;
-        }
-        .video-wrapper h2 {
-            text-align: center;
-            margin-bottom: 10px;
-            font-size: 18px;
-        }
-        video {
-            width: 100%;
-            height: auto;
-            background-color: #000;
-            display: block;
-        }
-        .controls {
-            background-color: #2a2a2a;
-            padding: 20px;
-            border-radius: 8px;
-            margin-bottom: 20px;
-        }
-        .control-group {
-            display: flex;
-            align-items: center;
-            gap: 15px;
-            margin-bottom: 15px;
-            flex-wrap: wrap;
-        }
-        .control-group:last-child {
-            margin-bottom: 0;
-        }
-        button {
-            padding: 10px 20px;
-            font-size: 16px;
-            background-color: #4CAF50;
-            color: white;
-            border: none;
-            border-radius: 4px;
-            cursor: pointer;
-            transition: background-color 0.3s;
-        }
-        button:hover {
-            background-color: #45a049;
-        }
-        button:active {
-            background-color: #3d8b40;
-        }
-        .speed-control {
-            display: flex;
-            align-items: center;
-            gap: 10px;
-        }
-        .speed-btn {
-            padding: 8px 15px;
-            font-size: 14px;
-            background-color: #2196F3;
-        }
-        .speed-btn:hover {
-            background-color: #0b7dda;
-        }
-        .speed-btn.active {
-            background-color: #0b7dda;
-            font-weight: bold;
-        }
-        input[type="range"] {
-            flex: 1;
-            min-width: 200px;
-            height: 6px;
-            background: #444;
-            border-radius: 3px;
-            outline: none;
-        }
-        input[type="range"]::-webkit-slider-thumb {
-            -webkit-appearance: none;
-            appearance: none;
-            width: 16px;
-            height: 16px;
-            background: #4CAF50;
-            cursor: pointer;
-            border-radius: 50%;
-        }
-        input[type="range"]::-moz-range-thumb {
-            width: 16px;
-            height: 16px;
-            background: #4CAF50;
-            cursor: pointer;
-            border-radius: 50%;
-            border: none;
-        }
-        .time-display {
-            font-family: monospace;
-            font-size: 16px;
-            min-width: 150px;
-        }
-        label {
-            font-weight: bold;
-            min-width: 80px;
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>2D FFT Video Analysis</h1>
-
-        <div class="controls">
-            <div class="control-group">
-                <button id="playPauseBtn" onclick="togglePlayPause()">▶ Play</button>
-                <button onclick="stepBackward()">⏮ -1 Frame</button>
-                <button onclick="stepForward()">⏭ +1 Frame</button>
-                <div class="time-display">
-                    <span id="currentTime">0:00.00</span> / <span id="duration">0:00.00</span>
-                </div>
-            </div>
-
-            <div class="control-group">
-                <label>Progress:</label>
-                <input type="range" id="seekBar" value="0" min="0" max="100" step="0.1" oninput="seek()">
-            </div>
-
-            <div class="control-group">
-                <label>Speed:</label>
-                <div class="speed-control">
-                    <button class="speed-btn" onclick="setSpeed(0.25)">0.25x</button>
-                    <button class="speed-btn" onclick="setSpeed(0.5)">0.5x</button>
-                    <button class="speed-btn active" onclick="setSpeed(1)">1x</button>
-                    <button class="speed-btn" onclick="setSpeed(1.5)">1.5x</button>
-                    <button class="speed-btn" onclick="setSpeed(2)">2x</button>
-                </div>
-            </div>
-        </div>
-
-        <div class="video-container">
-            <div class="video-wrapper">
-                <h2>Original Video (Grayscale)</h2>
-                <video id="video1" src="INPUT_VIDEO"></video>
-            </div>
-            <div class="video-wrapper">
-                <h2>2D FFT (Log Magnitude Spectrum)</h2>
-                <video id="video2" src="OUTPUT_VIDEO"></video>
-            </div>
-        </div>
-    </div>
-
-    <script>
-        const video1 = document.getElementById('video1');
-        const video2 = document.getElementById('video2');
-        const playPauseBtn = document.getElementById('playPauseBtn');
-        const seekBar = document.getElementById('seekBar');
-        const currentTimeDisplay = document.getElementById('currentTime');
-        const durationDisplay = document.getElementById('duration');
-
-        let isSeeking = false;
-
-        // Synchronize videos
-        function syncVideos(source) {
-            if (!isSeeking) {
-                const target = source === video1 ? video2 : video1;
-                if (Math.abs(source.currentTime - target.currentTime) > 0.05) {
-                    target.currentTime = source.currentTime;
-                }
-            }
-        }
-
-        video1.addEventListener('timeupdate', () => {
-            syncVideos(video1);
-            updateProgress();
-        });
-
-        video2.addEventListener('timeupdate', () => {
-            syncVideos(video2);
-        });
-
-        // Play/Pause
-        function togglePlayPause() {
-            if (video1.paused) {
-                video1.play();
-                video2.play();
-                playPauseBtn.textContent = '⏸ Pause';
-            } else {
-                video1.pause();
-                video2.pause();
-                playPauseBtn.textContent = '▶ Play';
-            }
-        }
-
-        // Seek
-        function seek() {
-            isSeeking = true;
-            const time = (seekBar.value / 100) * video1.duration;
-            video1.currentTime = time;
-            video2.currentTime = time;
-            setTimeout(() => { isSeeking = false; }, 100);
-        }
-
-        // Update progress bar and time display
-        function updateProgress() {
-            if (!isSeeking && video1.duration) {
-                seekBar.value = (video1.currentTime / video1.duration) * 100;
-                currentTimeDisplay.textContent = formatTime(video1.currentTime);
-            }
-        }
-
-        // Set duration when metadata is loaded
-        video1.addEventListener('loadedmetadata', () => {
-            durationDisplay.textContent = formatTime(video1.duration);
-        });
-
-        // Format time as M:SS.ss
-        function formatTime(seconds) {
-            const mins = Math.floor(seconds / 60);
-            const secs = (seconds % 60).toFixed(2);
-            return `${mins}:${secs.padStart(5, '0')}`;
-        }
-
-        // Speed control
-        function setSpeed(speed) {
-            video1.playbackRate = speed;
-            video2.playbackRate = speed;
-
-            // Update active button
-            document.querySelectorAll('.speed-btn').forEach(btn => {
-                btn.classList.remove('active');
-            });
-            event.target.classList.add('active');
-        }
-
-        // Frame stepping
-        function stepForward() {
-            const wasPlaying = !video1.paused;
-            video1.pause();
-            video2.pause();
-            playPauseBtn.textContent = '▶ Play';
-
-            // Step forward by 1/fps seconds (approximate)
-            const fps = 30; // Approximate, adjust if needed
-            video1.currentTime = Math.min(video1.currentTime + 1/fps, video1.duration);
-            video2.currentTime = video1.currentTime;
-        }
-
-        function stepBackward() {
-            const wasPlaying = !video1.paused;
-            video1.pause();
-            video2.pause();
-            playPauseBtn.textContent = '▶ Play';
-
-            // Step backward by 1/fps seconds (approximate)
-            const fps = 30; // Approximate, adjust if needed
-            video1.currentTime = Math.max(video1.currentTime - 1/fps, 0);
-            video2.currentTime = video1.currentTime;
-        }
-
-        // Keyboard shortcuts
-        document.addEventListener('keydown', (e) => {
-            switch(e.key) {
-                case ' ':
-                    e.preventDefault();
-                    togglePlayPause();
-                    break;
-                case 'ArrowRight':
-                    stepForward();
-                    break;
-                case 'ArrowLeft':
-                    stepBackward();
-                    break;
-            }
-        });
-
-        // Sync play/pause state
-        video1.addEventListener('play', () => { video2.play(); });
-        video1.addEventListener('pause', () => { video2.pause(); });
-        video2.addEventListener('play', () => { video1.play(); });
-        video2.addEventListener('pause', () => { video1.pause(); });
-    </script>
-</body>
-</html>"""
-
-    # Replace placeholders
-    html_content = html_content.replace('INPUT_VIDEO', input_name)
-    html_content = html_content.replace('OUTPUT_VIDEO', output_name)
+    # Load the template from disk and substitute the video sources;
+    # string.Template leaves the CSS/JS braces alone
+    template_path = Path(__file__).parent / 'templates' / 'viewer.html'
+    with open(template_path, encoding='utf-8') as f:
+        template = string.Template(f.read())
 
     # Write HTML file
     with open(html_path, 'w', encoding='utf-8') as f:
-        f.write(html_content)
+        f.write(template.safe_substitute(
+            input_video=input_name,
+            output_video=output_name,
+        ))
 
     print(f"HTML visualization generated: {html_path}")
 
@@ -426,6 +791,18 @@ def main():
         default='visualization.html',
         help='Path to output HTML file (default: visualization.html)'
     )
+    parser.add_argument(
+        '--batch', '-b',
+        type=int,
+        default=DEFAULT_BATCH,
+        help=f'Number of frames per batched FFT call (default: {DEFAULT_BATCH})'
+    )
+    parser.add_argument(
+        '--pad-pow2',
+        action='store_true',
+        help='Zero-pad frames to the next power of two before the FFT '
+             '(faster radix-2 path; spectrum is cropped back for display)'
+    )
 
     args = parser.parse_args()
 
@@ -435,10 +812,17 @@ def main():
         print(f"Error: Input file not found: {args.input}")
         return 1
 
+    # A batch size below 1 would make the reader loop spin forever
+    # without ever filling a batch
+    if args.batch < 1:
+        print(f"Error: --batch must be at least 1 (got {args.batch})")
+        return 1
+
     # Process video
     try:
         output_path = str(Path(args.output).resolve())
-        process_video(str(input_path), output_path)
+        process_video(str(input_path), output_path, batch_size=args.batch,
+                      pad_pow2=args.pad_pow2)
 
         # Generate HTML
         html_path = str(Path(args.html).resolve())